@@ -0,0 +1,20 @@
+import os
+
+from celery import Celery
+from celery.signals import worker_init
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'defect_detection_project.settings')
+
+app = Celery('defect_detection_project')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
+
+
+@worker_init.connect
+def preload_detection_pipeline(**kwargs):
+    """Загружает Gemini-пайплайн при старте воркера; без GOOGLE_API_KEY воркер не стартует"""
+    try:
+        import detection_api.defect_detection_pipeline  # noqa: F401
+    except RuntimeError as exc:
+        # Обычные исключения из обработчиков сигналов Celery только логирует
+        raise SystemExit(f'Refusing to start Celery worker: {exc}') from exc
@@ -0,0 +1,94 @@
+import base64
+import json
+import os
+
+import cv2
+
+from .imaging import encode_jpeg
+
+
+# Демо-картинки статичны, поэтому кодируем их один раз и держим в памяти.
+# Кэш сбрасывается, когда меняется mtime папки или любого из файлов.
+# manage.py build_demo_manifest сохраняет тот же payload в manifest.json вместе
+# со списком исходных файлов, чтобы view мог отдать его без кодирования.
+DEMO_FORMATS = ('.jpg', '.jpeg', '.png', '.webp')
+DEMO_MANIFEST = 'manifest.json'
+
+_DEMO_CACHE = None
+_DEMO_MTIME = None
+_MANIFEST_FILES = None
+_MANIFEST_MTIME = None
+
+
+def list_demo_files(demo_path):
+    """Пути к поддерживаемым картинкам в папке demo"""
+    return sorted(
+        os.path.join(demo_path, filename)
+        for filename in os.listdir(demo_path)
+        if filename.lower().endswith(DEMO_FORMATS)
+    )
+
+
+def build_demo_images(files):
+    """Читает демо-картинки и кодирует их в base64 data-URL"""
+    demo_images = []
+    for file_path in files:
+        # Открываем сразу в BGR и конвертируем в base64
+        image_bgr = cv2.imread(file_path, cv2.IMREAD_COLOR)
+        if image_bgr is None:
+            continue
+        image_base64 = base64.b64encode(encode_jpeg(image_bgr)).decode()
+        
+        demo_images.append({
+            'name': os.path.splitext(os.path.basename(file_path))[0],  # Имя без расширения
+            'image_base64': f'data:image/jpeg;base64,{image_base64}'
+        })
+    return demo_images
+
+
+def get_demo_images(demo_path, files):
+    """Возвращает закэшированные демо-картинки, пересобирая их при изменениях"""
+    global _DEMO_CACHE, _DEMO_MTIME
+    
+    mtime = max([os.path.getmtime(demo_path)] + [os.path.getmtime(f) for f in files])
+    if _DEMO_CACHE is None or mtime != _DEMO_MTIME:
+        _DEMO_CACHE = build_demo_images(files)
+        _DEMO_MTIME = mtime
+    return _DEMO_CACHE
+
+
+def write_manifest(manifest_path, files):
+    """Кодирует картинки и пишет manifest.json; возвращает число картинок"""
+    demo_images = build_demo_images(files)
+    
+    # Пишем во временный файл и подменяем атомарно, чтобы view не прочитал половину
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'files': [os.path.basename(f) for f in files],
+            'demo_images': demo_images
+        }, f)
+    os.replace(tmp_path, manifest_path)
+    return len(demo_images)
+
+
+def _manifest_files(manifest_path, manifest_mtime):
+    """Список исходных файлов из манифеста (читаем заново, только если он изменился)"""
+    global _MANIFEST_FILES, _MANIFEST_MTIME
+    
+    if _MANIFEST_FILES is None or manifest_mtime != _MANIFEST_MTIME:
+        with open(manifest_path, encoding='utf-8') as f:
+            _MANIFEST_FILES = json.load(f).get('files')
+        _MANIFEST_MTIME = manifest_mtime
+    return _MANIFEST_FILES
+
+
+def manifest_is_fresh(manifest_path, files):
+    """Манифест собран ровно из этих файлов и не старше ни одного из них"""
+    if not os.path.exists(manifest_path):
+        return False
+    manifest_mtime = os.path.getmtime(manifest_path)
+    if any(os.path.getmtime(f) > manifest_mtime for f in files):
+        return False
+    # Добавленные или удалённые картинки mtime оставшихся файлов не меняют
+    return _manifest_files(manifest_path, manifest_mtime) == [os.path.basename(f) for f in files]
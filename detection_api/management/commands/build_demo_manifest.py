@@ -0,0 +1,22 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection_api.demo_images import DEMO_MANIFEST, list_demo_files, write_manifest
+
+
+class Command(BaseCommand):
+    help = 'Кодирует демо-картинки из STATIC_ROOT/demo в manifest.json для /api/demo-images/'
+
+    def handle(self, *args, **options):
+        demo_path = os.path.join(settings.STATIC_ROOT, 'demo')
+        if not os.path.isdir(demo_path):
+            raise CommandError('Demo folder not found. Run collectstatic first.')
+
+        manifest_path = os.path.join(demo_path, DEMO_MANIFEST)
+        count = write_manifest(manifest_path, list_demo_files(demo_path))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {count} demo image(s) to {manifest_path}'
+        ))
@@ -1,5 +1,6 @@
 let demoImagesLoaded = false;
 let currentStream = null;
+let currentImageSize = { width: 512, height: 512 };
 
 async function openCamera() {
     try {
@@ -166,8 +167,8 @@ function capturePhoto() {
 function handleFileSelect(event) {
     const file = event.target.files[0];
     if (file) {
-        if (!file.type.startsWith('image/')) {
-            showError('Please select a valid image file');
+        if (!['image/jpeg', 'image/png', 'image/webp'].includes(file.type)) {
+            showError('Please select a JPEG, PNG or WebP image');
             return;
         }
         
@@ -275,10 +276,17 @@ async function processImage(imageBlob) {
         
         const data = await response.json();
         
-        if (data.success) {
-            displayResults(data);
-        } else {
+        if (!data.success) {
             showError(data.error || 'Processing failed');
+            return;
+        }
+        
+        const result = await pollDetection(data.status_url);
+        
+        if (result.success) {
+            displayResults({ ...data, detections: result.detections });
+        } else {
+            showError(result.error || 'Processing failed');
         }
     } catch (error) {
         showError('Network error. Please try again.');
@@ -287,6 +295,24 @@ async function processImage(imageBlob) {
     }
 }
 
+async function pollDetection(statusUrl) {
+    const pollInterval = 1000;
+    const maxAttempts = 120;
+    
+    for (let attempt = 0; attempt < maxAttempts; attempt++) {
+        const response = await fetch(statusUrl);
+        const data = await response.json();
+        
+        if (data.status === 'SUCCESS' || data.status === 'FAILURE') {
+            return data;
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, pollInterval));
+    }
+    
+    return { success: false, error: 'Detection timed out. Please try again.' };
+}
+
 function displayResults(data) {
     const resultSection = document.getElementById('resultSection');
     const processedImage = document.getElementById('processedImage');
@@ -294,7 +320,8 @@ function displayResults(data) {
     const summaryContainer = document.getElementById('detectionSummary');
     const listContainer = document.getElementById('detectionList');
     
-    processedImage.src = data.image_base64;
+    currentImageSize = data.image_size || { width: 512, height: 512 };
+    processedImage.src = data.image_url;
     processedImage.onload = () => {
         setTimeout(() => {
             drawBoundingBoxes(data.detections);
@@ -346,10 +373,11 @@ function drawBoundingBoxes(detections) {
         const div = document.createElement('div');
         div.className = `bbox bbox-${detection.type}`;
         
-        const leftPercent = (bbox.x1 / 512) * 100;
-        const topPercent = (bbox.y1 / 512) * 100;
-        const widthPercent = ((bbox.x2 - bbox.x1) / 512) * 100;
-        const heightPercent = ((bbox.y2 - bbox.y1) / 512) * 100;
+        const { width, height } = currentImageSize;
+        const leftPercent = (bbox.x1 / width) * 100;
+        const topPercent = (bbox.y1 / height) * 100;
+        const widthPercent = ((bbox.x2 - bbox.x1) / width) * 100;
+        const heightPercent = ((bbox.y2 - bbox.y1) / height) * 100;
         
         div.style.left = leftPercent + '%';
         div.style.top = topPercent + '%';
@@ -533,12 +561,13 @@ window.addEventListener('resize', () => {
     const container = document.getElementById('bboxContainer');
     if (container.children.length > 0) {
         setTimeout(() => {
+            const { width, height } = currentImageSize;
             const detections = Array.from(container.children).map(child => ({
                 bbox: {
-                    x1: parseFloat(child.style.left) * 512 / 100,
-                    y1: parseFloat(child.style.top) * 512 / 100,
-                    x2: (parseFloat(child.style.left) + parseFloat(child.style.width)) * 512 / 100,
-                    y2: (parseFloat(child.style.top) + parseFloat(child.style.height)) * 512 / 100
+                    x1: parseFloat(child.style.left) * width / 100,
+                    y1: parseFloat(child.style.top) * height / 100,
+                    x2: (parseFloat(child.style.left) + parseFloat(child.style.width)) * width / 100,
+                    y2: (parseFloat(child.style.top) + parseFloat(child.style.height)) * height / 100
                 },
                 type: child.classList.contains('bbox-crack') ? 'crack' : 'moisture',
                 category: {
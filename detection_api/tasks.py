@@ -0,0 +1,175 @@
+import hashlib
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+
+# defect_detection_pipeline (google.genai со всеми зависимостями) импортируется
+# внутри задач: web-процесс тоже импортирует этот модуль, но ему Gemini не нужен
+
+# Картинки кладёт в кэш view (для image_url), задачи читают их оттуда же,
+# поэтому через брокер идёт только id, а не сами байты
+IMAGE_CACHE_KEY = 'detection-image:{}'
+
+# Результат Gemini кэшируется в Redis по хэшу содержимого картинок: общий для
+# всех воркеров и переживает их перезапуск, поэтому одинаковые загрузки
+# (например, демо-картинки) не идут в модель повторно
+RESULT_CACHE_KEY = 'detection-result:{}:{}'
+
+_MODEL = 'gemini-2.5-pro'
+
+
+def _load_image(image_id):
+    """Достаёт JPEG из кэша по id"""
+    jpg = cache.get(IMAGE_CACHE_KEY.format(image_id))
+    if jpg is None:
+        raise LookupError(f'Image {image_id} not found or expired')
+    return jpg
+
+
+def _keep_images(image_ids):
+    """Продлевает жизнь картинок до срока жизни результата задачи"""
+    for image_id in image_ids:
+        cache.touch(IMAGE_CACHE_KEY.format(image_id), settings.DETECTION_TTL)
+
+
+def _result_cache_key(images):
+    """Ключ кэша результата: модель и blake2b от каждой картинки по порядку"""
+    digest = hashlib.blake2b(digest_size=16)
+    for jpg in images:
+        digest.update(hashlib.blake2b(jpg, digest_size=16).digest())
+    return RESULT_CACHE_KEY.format(_MODEL, digest.hexdigest())
+
+
+def _detect(images):
+    """Детекция через Gemini с кэшем результата в Redis"""
+    from .defect_detection_pipeline import DefectDetectionResult, detect_defects_bytes
+    
+    key = _result_cache_key(images)
+    cached = cache.get(key)
+    if cached is not None:
+        return DefectDetectionResult.model_validate_json(cached)
+    
+    gemini_result = detect_defects_bytes(images, model=_MODEL)
+    cache.set(key, gemini_result.model_dump_json(), settings.DETECTION_RESULT_TTL)
+    return gemini_result
+
+
+@shared_task
+def run_detection(image_id, width, height):
+    """Детекция одной картинки в воркере Celery"""
+    gemini_result = _detect([_load_image(image_id)])
+    
+    _keep_images([image_id])
+    return {'detections': convert_gemini_to_our_format(gemini_result, width, height)}
+
+
+@shared_task
+def run_batch_detection(image_ids, sizes):
+    """Детекция нескольких картинок одним запросом к модели"""
+    from .defect_detection_pipeline import split_by_image
+    
+    # Все картинки уходят в модель одним вызовом, результат делим по image_index
+    gemini_result = _detect([_load_image(image_id) for image_id in image_ids])
+    per_image = split_by_image(gemini_result, len(image_ids))
+    
+    _keep_images(image_ids)
+    return {'results': [
+        {'detections': convert_gemini_to_our_format(result, width, height)}
+        for result, (width, height) in zip(per_image, sizes)
+    ]}
+
+
+def convert_gemini_to_our_format(gemini_result, width=512, height=512):
+    """Конвертируем результат Gemini в формат нашего фронтенда (пиксели width x height)"""
+    
+    # Маппинг категорий damage
+    damage_categories = {
+        0: {'id': 0, 'name': 'Hairline', 'type': 'crack'},
+        1: {'id': 1, 'name': 'Fine', 'type': 'crack'},
+        2: {'id': 2, 'name': 'Aesthetic (>1 <5mm)', 'type': 'crack'},
+        3: {'id': 3, 'name': 'Serviceability (>5 <15mm)', 'type': 'crack'},
+        4: {'id': 4, 'name': 'Serviceability (>15 <25mm)', 'type': 'crack'},
+        5: {'id': 5, 'name': 'Stability (>25mm)', 'type': 'crack'},
+    }
+    
+    # Маппинг типов moisture
+    moisture_categories = {
+        'RD': {'id': 'RD', 'name': 'Rising Damp', 'type': 'moisture'},
+        'PD': {'id': 'PD', 'name': 'Penetrating Damp', 'type': 'moisture'},
+        'C': {'id': 'C', 'name': 'Condensation', 'type': 'moisture'},
+    }
+    
+    detections = []
+    detection_id = 1
+    
+    # Обрабатываем damage (трещины)
+    for damage in gemini_result.damage:
+        # Конвертируем bbox из формата [y_min, x_min, y_max, x_max] (0-1000) в наш формат
+        y_min, x_min, y_max, x_max = damage.bbox
+        
+        # Переводим из координат 0-1000 в пиксели картинки
+        x1 = int(x_min * width / 1000)
+        y1 = int(y_min * height / 1000)
+        x2 = int(x_max * width / 1000)
+        y2 = int(y_max * height / 1000)
+        
+        # Убеждаемся что координаты в пределах изображения
+        x1 = max(0, min(x1, width))
+        y1 = max(0, min(y1, height))
+        x2 = max(0, min(x2, width))
+        y2 = max(0, min(y2, height))
+        
+        category = damage_categories.get(damage.category, damage_categories[1])
+        
+        detection = {
+            'id': detection_id,
+            'type': 'crack',
+            'category': category,
+            'bbox': {
+                'x1': x1,
+                'y1': y1,
+                'x2': x2,
+                'y2': y2
+            },
+            'confidence': 0.95  # Фиксированный confidence для Gemini
+        }
+        
+        detections.append(detection)
+        detection_id += 1
+    
+    # Обрабатываем moisture (влагу)
+    for moisture in gemini_result.moisture:
+        # Конвертируем bbox
+        y_min, x_min, y_max, x_max = moisture.bbox
+        
+        x1 = int(x_min * width / 1000)
+        y1 = int(y_min * height / 1000)
+        x2 = int(x_max * width / 1000)
+        y2 = int(y_max * height / 1000)
+        
+        x1 = max(0, min(x1, width))
+        y1 = max(0, min(y1, height))
+        x2 = max(0, min(x2, width))
+        y2 = max(0, min(y2, height))
+        
+        category = moisture_categories.get(moisture.moisture_type, moisture_categories['C'])
+        
+        detection = {
+            'id': detection_id,
+            'type': 'moisture',
+            'category': category,
+            'bbox': {
+                'x1': x1,
+                'y1': y1,
+                'x2': x2,
+                'y2': y2
+            },
+            'confidence': 0.95
+        }
+        
+        detections.append(detection)
+        detection_id += 1
+    
+    return detections
+
@@ -1 +1,522 @@
-pass
\ No newline at end of file
+import io
+import os
+import shutil
+import sys
+import tempfile
+from unittest import mock
+
+# Пайплайн не импортируется без ключа; в тестах Gemini всегда замокан
+os.environ.setdefault('GOOGLE_API_KEY', 'test-key')
+
+import httpx
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from google.genai import errors as genai_errors
+from PIL import Image
+from pydantic import ValidationError
+
+from defect_detection_project.celery import app as celery_app, preload_detection_pipeline
+
+from . import demo_images, tasks, views
+from .defect_detection_pipeline import (
+    DamageFinding,
+    DefectDetectionResult,
+    MoistureFinding,
+    _is_transient,
+    split_by_image,
+)
+from .tasks import IMAGE_CACHE_KEY, run_batch_detection
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_image(size, format='JPEG', mode='RGB', **save_kwargs):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color=128).save(buffer, format=format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def make_mpo(size):
+    """JPEG с вторым кадром (MPF), как у телефонных фото с gain map"""
+    return make_image(size, 'MPO', save_all=True, append_images=[Image.new('RGB', (64, 48))])
+
+
+def damage(image_index):
+    return DamageFinding(
+        image_index=image_index, bbox=[0, 0, 500, 500], category=1, classification='Aesthetic'
+    )
+
+
+def moisture(image_index):
+    return MoistureFinding(image_index=image_index, bbox=[0, 0, 500, 500], moisture_type='RD')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DetectionTestCase(TestCase):
+    """Celery выполняет задачи сразу, Gemini замокан, кэш в памяти"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+
+    @classmethod
+    def tearDownClass(cls):
+        celery_app.conf.task_always_eager = cls._eager
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch(
+            'detection_api.defect_detection_pipeline.detect_defects_bytes',
+            return_value=DefectDetectionResult(damage=[damage(0)]),
+        )
+        self.detect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, name='photo.jpg', content=None, content_type='image/jpeg'):
+        return SimpleUploadedFile(name, content or make_image((320, 240)), content_type=content_type)
+
+
+class SplitByImageTests(SimpleTestCase):
+    def test_findings_go_to_their_image(self):
+        result = DefectDetectionResult(damage=[damage(0), damage(2)], moisture=[moisture(1)])
+
+        per_image = split_by_image(result, 3)
+
+        self.assertEqual([len(r.damage) for r in per_image], [1, 0, 1])
+        self.assertEqual([len(r.moisture) for r in per_image], [0, 1, 0])
+
+    def test_out_of_range_index_is_dropped_with_warning(self):
+        result = DefectDetectionResult(damage=[damage(0), damage(5)], moisture=[moisture(7)])
+
+        with self.assertLogs('defect-detector', level='WARNING') as logs:
+            per_image = split_by_image(result, 2)
+
+        self.assertEqual(len(per_image[0].damage), 1)
+        self.assertFalse(per_image[1].damage or per_image[1].moisture)
+        self.assertEqual(len(logs.records), 2)
+
+    def test_missing_index_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            DefectDetectionResult.model_validate({
+                'damage': [{'bbox': [0, 0, 1, 1], 'category': 1, 'classification': 'Aesthetic'}]
+            })
+        self.assertIn('image_index', DamageFinding.model_json_schema()['required'])
+        self.assertIn('image_index', MoistureFinding.model_json_schema()['required'])
+
+
+class BatchDetectionTests(DetectionTestCase):
+    def test_batch_over_limit_is_400(self):
+        uploads = [self.upload(f'{i}.jpg') for i in range(17)]
+
+        response = self.client.post('/api/detect/batch/', {'images': uploads})
+
+        self.assertEqual(response.status_code, 400)
+        self.detect.assert_not_called()
+
+    def test_batch_sends_one_call_and_splits_results(self):
+        self.detect.return_value = DefectDetectionResult(damage=[damage(1)], moisture=[moisture(0)])
+        uploads = [self.upload(f'{i}.jpg') for i in range(2)]
+
+        response = self.client.post('/api/detect/batch/', {'images': uploads})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(len(self.detect.call_args.args[0]), 2)
+
+    def test_batch_task_result_follows_image_index(self):
+        cache.set(IMAGE_CACHE_KEY.format('a'), make_image((64, 64)))
+        cache.set(IMAGE_CACHE_KEY.format('b'), make_image((64, 64)))
+        self.detect.return_value = DefectDetectionResult(damage=[damage(1)], moisture=[moisture(0)])
+
+        result = run_batch_detection.apply(args=[['a', 'b'], [[64, 64], [64, 64]]]).get()
+
+        first, second = result['results']
+        self.assertEqual([d['type'] for d in first['detections']], ['moisture'])
+        self.assertEqual([d['type'] for d in second['detections']], ['crack'])
+
+
+class DemoImagesTestCase(TestCase):
+    """Временная папка STATIC_ROOT/demo с тремя картинками и пустой кэш в памяти"""
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        self.demo_path = os.path.join(self.static_root, 'demo')
+        os.mkdir(self.demo_path)
+        for i in range(3):
+            with open(os.path.join(self.demo_path, f'demo_{i}.png'), 'wb') as f:
+                f.write(make_image((64, 64), 'PNG'))
+        override = override_settings(STATIC_ROOT=self.static_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        for name in ('_DEMO_CACHE', '_DEMO_MTIME'):
+            patcher = mock.patch.object(demo_images, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class DemoImagesCacheTests(DemoImagesTestCase):
+    def build_spy(self):
+        patcher = mock.patch.object(
+            demo_images, 'build_demo_images', wraps=demo_images.build_demo_images
+        )
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_images_are_encoded_once(self):
+        build = self.build_spy()
+
+        first = self.client.get('/api/demo-images/').json()
+        second = self.client.get('/api/demo-images/').json()
+
+        self.assertEqual(len(first['demo_images']), 3)
+        self.assertEqual(first, second)
+        build.assert_called_once()
+
+    def test_changed_file_rebuilds_cache(self):
+        build = self.build_spy()
+        self.client.get('/api/demo-images/')
+
+        changed = os.path.join(self.demo_path, 'demo_0.png')
+        mtime = os.path.getmtime(changed) + 10
+        os.utime(changed, (mtime, mtime))
+        self.client.get('/api/demo-images/')
+
+        self.assertEqual(build.call_count, 2)
+
+
+class DemoManifestTests(DemoImagesTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ('_MANIFEST_FILES', '_MANIFEST_MTIME'):
+            patcher = mock.patch.object(demo_images, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        call_command('build_demo_manifest', stdout=io.StringIO())
+        self.manifest_path = os.path.join(self.demo_path, demo_images.DEMO_MANIFEST)
+
+    def test_fresh_manifest_is_streamed(self):
+        files = demo_images.list_demo_files(self.demo_path)
+        self.assertTrue(demo_images.manifest_is_fresh(self.manifest_path, files))
+
+        response = self.client.get('/api/demo-images/')
+
+        self.assertTrue(response.streaming)
+
+    def test_deleted_file_makes_manifest_stale(self):
+        os.remove(os.path.join(self.demo_path, 'demo_2.png'))
+
+        response = self.client.get('/api/demo-images/')
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(response.json()['demo_images']), 2)
+
+    def test_added_file_makes_manifest_stale(self):
+        files = demo_images.list_demo_files(self.demo_path)
+        os.utime(self.manifest_path, (os.path.getmtime(self.manifest_path) + 10,) * 2)
+        with open(os.path.join(self.demo_path, 'demo_3.png'), 'wb') as f:
+            f.write(make_image((64, 64), 'PNG'))
+
+        self.assertTrue(demo_images.manifest_is_fresh(self.manifest_path, files))
+        self.assertFalse(demo_images.manifest_is_fresh(
+            self.manifest_path, demo_images.list_demo_files(self.demo_path)
+        ))
+
+
+class PrepareJpegTests(SimpleTestCase):
+    def test_small_plain_jpeg_is_passed_through(self):
+        raw = make_image((320, 240))
+
+        jpg, size = views._prepare_jpeg(raw)
+
+        self.assertIs(jpg, raw)
+        self.assertEqual(size, (320, 240))
+
+    def test_small_png_is_reencoded_as_jpeg(self):
+        jpg, size = views._prepare_jpeg(make_image((320, 240), 'PNG'))
+
+        self.assertEqual(size, (512, 512))
+        with Image.open(io.BytesIO(jpg)) as image:
+            self.assertEqual(image.format, 'JPEG')
+
+    def test_large_image_is_resized_to_512(self):
+        jpg, size = views._prepare_jpeg(make_image((2048, 1536), 'PNG'))
+
+        self.assertEqual(size, (512, 512))
+        with Image.open(io.BytesIO(jpg)) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (512, 512)))
+
+
+class ResultCacheTests(DetectionTestCase):
+    def test_same_images_call_gemini_once(self):
+        jpg = make_image((64, 64))
+
+        first = tasks._detect([jpg])
+        second = tasks._detect([jpg])
+
+        self.detect.assert_called_once()
+        self.assertEqual(first, second)
+
+    def test_key_depends_on_every_image_and_its_order(self):
+        a, b = make_image((64, 64)), make_image((32, 32))
+
+        tasks._detect([a, b])
+        tasks._detect([b, a])
+        tasks._detect([a])
+
+        self.assertEqual(self.detect.call_count, 3)
+
+    def test_cached_result_is_not_shared_with_callers(self):
+        jpg = make_image((64, 64))
+
+        tasks._detect([jpg]).damage.clear()
+
+        self.assertEqual(len(tasks._detect([jpg]).damage), 1)
+
+
+class StripMetadataTests(SimpleTestCase):
+    def test_small_jpeg_with_exif_is_reencoded_without_it(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'CameraMaker'
+        raw = make_image((320, 240), exif=exif.tobytes())
+
+        jpg, size = views._prepare_jpeg(raw)
+
+        self.assertNotEqual(jpg, raw)
+        self.assertEqual(size, (320, 240))
+        with Image.open(io.BytesIO(jpg)) as image:
+            self.assertNotIn('exif', image.info)
+
+    def test_small_jpeg_with_comment_is_reencoded(self):
+        raw = make_image((320, 240), comment=b'GPS 51.1, 71.4')
+
+        jpg, _ = views._prepare_jpeg(raw)
+
+        with Image.open(io.BytesIO(jpg)) as image:
+            self.assertNotIn('comment', image.info)
+
+    def test_encoded_jpeg_carries_no_metadata(self):
+        jpg, _ = views._prepare_jpeg(make_image((1024, 768), 'PNG'))
+
+        with Image.open(io.BytesIO(jpg)) as image:
+            self.assertFalse(views._has_metadata(image))
+
+
+class IsTransientTests(SimpleTestCase):
+    def test_rate_limit_and_server_errors_are_retried(self):
+        self.assertTrue(_is_transient(genai_errors.ClientError(429, {'error': {'code': 429}})))
+        self.assertTrue(_is_transient(genai_errors.ClientError(408, {'error': {'code': 408}})))
+        self.assertTrue(_is_transient(genai_errors.ServerError(503, {'error': {'code': 503}})))
+        self.assertTrue(_is_transient(httpx.ReadTimeout('timed out')))
+
+    def test_client_and_parse_errors_are_not_retried(self):
+        self.assertFalse(_is_transient(genai_errors.ClientError(400, {'error': {'code': 400}})))
+        self.assertFalse(_is_transient(genai_errors.ClientError(403, {'error': {'code': 403}})))
+        self.assertFalse(_is_transient(ValueError('bad schema')))
+
+
+class DetectionTaskTests(DetectionTestCase):
+    def test_detect_queues_task_and_serves_image(self):
+        response = self.client.post('/api/detect/', {'image': self.upload()})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['image_size'], {'width': 320, 'height': 240})
+        self.detect.assert_called_once()
+
+        image = self.client.get(response.json()['image_url'])
+        self.assertEqual(image.status_code, 200)
+        self.assertEqual(image['Content-Type'], 'image/jpeg')
+
+    def test_expired_image_is_404(self):
+        response = self.client.get('/api/detect/00000000-0000-0000-0000-000000000000/image/')
+
+        self.assertEqual(response.status_code, 404)
+
+
+class DetectionStatusTests(SimpleTestCase):
+    task_id = '00000000-0000-0000-0000-000000000001'
+
+    def get_status(self, **result):
+        with mock.patch('detection_api.views.AsyncResult') as async_result:
+            async_result.return_value = mock.Mock(**result)
+            return self.client.get(f'/api/detect/{self.task_id}/')
+
+    def test_success_returns_task_result(self):
+        response = self.get_status(
+            status='SUCCESS', result={'detections': []},
+            **{'successful.return_value': True, 'failed.return_value': False}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'success': True, 'status': 'SUCCESS', 'detections': []})
+
+    def test_failure_is_500_with_error(self):
+        response = self.get_status(
+            status='FAILURE', result=RuntimeError('quota'),
+            **{'successful.return_value': False, 'failed.return_value': True}
+        )
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['status'], 'FAILURE')
+        self.assertIn('quota', response.json()['error'])
+
+    def test_pending_returns_only_status(self):
+        response = self.get_status(
+            status='PENDING',
+            **{'successful.return_value': False, 'failed.return_value': False}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'PENDING'})
+
+
+class CheckUploadTests(SimpleTestCase):
+    def test_too_large_file_is_413(self):
+        upload = SimpleUploadedFile('big.jpg', b'0' * (10 * 1024 * 1024 + 1), content_type='image/jpeg')
+
+        self.assertEqual(views._check_upload(upload).status_code, 413)
+
+    def test_unsupported_content_type_is_415(self):
+        upload = SimpleUploadedFile('anim.gif', make_image((8, 8), 'GIF'), content_type='image/gif')
+
+        self.assertEqual(views._check_upload(upload).status_code, 415)
+
+    def test_supported_upload_passes(self):
+        upload = SimpleUploadedFile('ok.png', make_image((8, 8), 'PNG'), content_type='image/png')
+
+        self.assertIsNone(views._check_upload(upload))
+
+    def test_small_mpo_is_reencoded_without_extra_frames(self):
+        raw = make_mpo((320, 240))
+
+        jpg, size = views._prepare_jpeg(raw)
+
+        self.assertNotEqual(jpg, raw)
+        self.assertEqual(size, (320, 240))
+        with Image.open(io.BytesIO(jpg)) as image:
+            self.assertEqual((image.format, getattr(image, 'n_frames', 1)), ('JPEG', 1))
+
+    def test_large_mpo_is_resized(self):
+        jpg, size = views._prepare_jpeg(make_mpo((2048, 1536)))
+
+        self.assertEqual(size, (512, 512))
+        with Image.open(io.BytesIO(jpg)) as image:
+            self.assertEqual(image.format, 'JPEG')
+
+    def test_unsupported_real_format_is_rejected(self):
+        with self.assertRaises(views.UnsupportedImageError):
+            views._prepare_jpeg(make_image((8, 8), 'GIF'))
+
+
+class UploadValidationTests(DetectionTestCase):
+    def test_non_image_bytes_are_415(self):
+        response = self.client.post('/api/detect/', {'image': self.upload(content=b'not an image')})
+
+        self.assertEqual(response.status_code, 415)
+        self.detect.assert_not_called()
+
+    def test_gif_declared_as_png_is_415(self):
+        upload = self.upload('anim.png', make_image((8, 8), 'GIF'), 'image/png')
+
+        response = self.client.post('/api/detect/', {'image': upload})
+
+        self.assertEqual(response.status_code, 415)
+
+    def test_mpo_declared_as_jpeg_is_accepted(self):
+        upload = self.upload('phone.jpg', make_mpo((320, 240)))
+
+        response = self.client.post('/api/detect/', {'image': upload})
+
+        self.assertEqual(response.status_code, 202)
+        image = self.client.get(response.json()['image_url'])
+        with Image.open(io.BytesIO(image.getvalue())) as forwarded:
+            self.assertEqual((forwarded.format, forwarded.size), ('JPEG', (320, 240)))
+
+    def test_too_many_pixels_is_413(self):
+        upload = self.upload('huge.png', make_image((5001, 5000), 'PNG', mode='L'), 'image/png')
+
+        response = self.client.post('/api/detect/', {'image': upload})
+
+        self.assertEqual(response.status_code, 413)
+
+    def test_batch_maps_errors_the_same_way(self):
+        uploads = [self.upload(), self.upload('bad.jpg', b'not an image')]
+
+        response = self.client.post('/api/detect/batch/', {'images': uploads})
+
+        self.assertEqual(response.status_code, 415)
+        self.detect.assert_not_called()
+
+    def test_unexpected_error_is_500(self):
+        with mock.patch('detection_api.views._store_image', side_effect=ConnectionError('redis down')):
+            response = self.client.post('/api/detect/', {'image': self.upload()})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['error'], 'Error processing image: redis down')
+
+
+class DraftResizeTests(SimpleTestCase):
+    def prepare(self, raw):
+        with mock.patch.object(
+            Image.Image, 'resize', autospec=True, side_effect=Image.Image.resize
+        ) as resize:
+            jpg, size = views._prepare_jpeg(raw)
+        self.assertEqual(size, (512, 512))
+        source, target, resample = resize.call_args.args
+        self.assertEqual(target, (512, 512))
+        return source.size, resample
+
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        decoded, resample = self.prepare(make_image((4096, 4096)))
+
+        self.assertEqual(decoded, (512, 512))
+        self.assertEqual(resample, Image.Resampling.BILINEAR)
+
+    def test_draft_never_goes_below_target(self):
+        decoded, resample = self.prepare(make_image((2048, 1536)))
+
+        self.assertEqual(decoded, (1024, 768))
+        self.assertEqual(resample, Image.Resampling.LANCZOS)
+
+    def test_png_is_not_drafted_and_uses_lanczos(self):
+        decoded, resample = self.prepare(make_image((2048, 2048), 'PNG'))
+
+        self.assertEqual(decoded, (2048, 2048))
+        self.assertEqual(resample, Image.Resampling.LANCZOS)
+
+    def test_mild_downscale_uses_bilinear(self):
+        decoded, resample = self.prepare(make_image((800, 600), 'PNG'))
+
+        self.assertEqual(decoded, (800, 600))
+        self.assertEqual(resample, Image.Resampling.BILINEAR)
+
+
+class WorkerStartupTests(SimpleTestCase):
+    def setUp(self):
+        # Модуль пайплайна импортируется заново; после теста возвращаем прежний
+        # и в sys.modules, и атрибутом пакета, чтобы mock.patch и задачи видели один объект
+        import detection_api
+        pipeline = 'detection_api.defect_detection_pipeline'
+        modules = mock.patch.dict(sys.modules)
+        modules.start()
+        self.addCleanup(modules.stop)
+        self.addCleanup(setattr, detection_api, 'defect_detection_pipeline', sys.modules[pipeline])
+        del sys.modules[pipeline]
+
+    def test_worker_refuses_to_start_without_api_key(self):
+        with mock.patch.dict(os.environ):
+            del os.environ['GOOGLE_API_KEY']
+
+            with self.assertRaisesMessage(SystemExit, 'GOOGLE_API_KEY'):
+                preload_detection_pipeline()
+
+    def test_worker_starts_with_api_key(self):
+        preload_detection_pipeline()
+
+        self.assertIn('detection_api.defect_detection_pipeline', sys.modules)
@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
     # API endpoints
     path('api/detect/', views.detect_defects_endpoint, name='detect_defects'),
+    path('api/detect/batch/', views.detect_defects_batch_endpoint, name='detect_defects_batch'),
+    path('api/detect/<uuid:task_id>/', views.get_detection_status, name='detection_status'),
+    path('api/detect/<uuid:image_id>/image/', views.get_detection_image, name='detection_image'),
     path('api/demo-images/', views.get_demo_images, name='demo_images'),
     path('api/health/', views.health_check, name='health_check'),
     
@@ -1,20 +1,149 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
+from celery.result import AsyncResult
 from PIL import Image
-import tempfile
-import shutil
-from pathlib import Path
+import numpy as np
+import cv2
 import io
-import base64
+import os
+import uuid
+
+from . import demo_images
+from .imaging import encode_jpeg
+# Детекция выполняется в воркере Celery, view только ставит задачу
+from .tasks import IMAGE_CACHE_KEY, run_batch_detection, run_detection
+
+
+_TARGET_SIZE = (512, 512)
+
+# Сколько картинок максимум уходит в один запрос к Gemini
+_MAX_BATCH_IMAGES = 16
+
+# Проверки загрузки до декодирования: размер файла, заявленный тип и число
+# пикселей (по заголовку), чтобы огромная картинка не распаковалась в память
+_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+_MAX_IMAGE_PIXELS = 25_000_000
+_ALLOWED_CONTENT_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
+# MPO - это JPEG с дополнительными кадрами (так снимают многие телефоны,
+# например HDR gain map у iPhone); браузер шлёт его как image/jpeg
+_JPEG_FORMATS = {'JPEG', 'MPO'}
+_ALLOWED_FORMATS = _JPEG_FORMATS | {'PNG', 'WEBP'}
+Image.MAX_IMAGE_PIXELS = _MAX_IMAGE_PIXELS
+
+
+def _encode_pil(image):
+    """Кодирует PIL-картинку (RGB) в JPEG"""
+    image_array = np.asarray(image)
+    image_bgr = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+    return encode_jpeg(image_bgr)
+
+
+# Служебные сегменты JPEG без данных о съёмке; всё остальное (EXIF, XMP,
+# комментарии, ICC, Photoshop, ...) считаем метаданными и перекодируем
+_PLAIN_JPEG_SEGMENTS = {('APP0', b'JFIF\x00'), ('APP14', b'Adobe')}
+
+
+class UnsupportedImageError(Exception):
+    """Файл открылся, но формат не JPEG/PNG/WebP (заявленный content type не совпал)"""
+
+
+def _has_metadata(image):
+    """Есть ли в JPEG сегменты APPn/COM помимо JFIF и Adobe"""
+    return any(
+        (marker, data[:5]) not in _PLAIN_JPEG_SEGMENTS
+        for marker, data in image.applist
+    )
+
+
+def _check_upload(image_file):
+    """Возвращает Response с ошибкой, если файл слишком большой или не того типа"""
+    if image_file.size > _MAX_UPLOAD_SIZE:
+        return Response(
+            {'error': f'Image too large: {image_file.name} (max {_MAX_UPLOAD_SIZE // (1024 * 1024)} MB)'}, 
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    if image_file.content_type not in _ALLOWED_CONTENT_TYPES:
+        return Response(
+            {'error': f'Unsupported image type: {image_file.content_type} (use JPEG, PNG or WebP)'}, 
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+    return None
+
+
+def _error_response(exc, what):
+    """Переводит ошибку при подготовке картинок в ответ 413, 415 или 500"""
+    if isinstance(exc, Image.DecompressionBombError):
+        return Response(
+            {'error': f'Image too large: {str(exc)}'}, 
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    if isinstance(exc, (Image.UnidentifiedImageError, UnsupportedImageError)):
+        return Response(
+            {'error': f'Unsupported image type: {str(exc)}'}, 
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+    return Response(
+        {'error': f'Error processing {what}: {str(exc)}'}, 
+        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+
+def _prepare_jpeg(raw):
+    """Возвращает JPEG-байты картинки для модели и её размер (width, height)"""
+    # Image.open читает только заголовок, пиксели пока не декодируются.
+    # Все PIL-картинки закрываем явно, чтобы буферы не ждали сборщика мусора.
+    with io.BytesIO(raw) as stream, Image.open(stream) as image:
+        # content type присылает клиент, поэтому проверяем реальный формат по заголовку
+        if image.format not in _ALLOWED_FORMATS:
+            raise UnsupportedImageError(f'{image.format} (use JPEG, PNG or WebP)')
+        if image.width * image.height > _MAX_IMAGE_PIXELS:
+            raise Image.DecompressionBombError(
+                f'{image.width}x{image.height} exceeds {_MAX_IMAGE_PIXELS} pixels'
+            )
+        
+        # Маленький JPEG не ресайзим; без метаданных отправляем как есть.
+        # MPO всегда перекодируем, чтобы в модель ушёл только первый кадр
+        if image.format in _JPEG_FORMATS and max(image.size) <= max(_TARGET_SIZE):
+            if image.format == 'JPEG' and not _has_metadata(image):
+                return raw, image.size
+            with image.convert('RGB') as rgb:
+                return _encode_pil(rgb), image.size
+        
+        # Для JPEG декодер сразу уменьшает в 2/4/8 раз (draft), но не меньше 512;
+        # для остальных форматов draft ничего не делает
+        image.draft('RGB', _TARGET_SIZE)
+        
+        # Ресайзим картинку до 512x512; LANCZOS нужен только при сильном уменьшении,
+        # после draft обычно остаётся меньше чем 2x и хватает BILINEAR
+        with image.convert('RGB') as rgb:
+            ratio = max(rgb.width / _TARGET_SIZE[0], rgb.height / _TARGET_SIZE[1])
+            resample = Image.Resampling.BILINEAR if ratio < 2 else Image.Resampling.LANCZOS
+            with rgb.resize(_TARGET_SIZE, resample) as resized_image:
+                return _encode_pil(resized_image), _TARGET_SIZE
+
+
+def _store_image(jpg):
+    """Кладёт JPEG в кэш и возвращает его id (по нему картинку берут и задача, и клиент)"""
+    image_id = str(uuid.uuid4())
+    # Картинка отдаётся отдельным GET вместо base64 в JSON и живёт в кэше
+    # столько же, сколько результат задачи
+    cache.set(IMAGE_CACHE_KEY.format(image_id), jpg, settings.DETECTION_TTL)
+    return image_id
+
+
+def _image_url(image_id):
+    return reverse('detection_image', args=[image_id])
 
-# Импортируем функцию детекции товарища
-from .defect_detection_pipeline import detect_defects
 
 @api_view(['POST'])
 def detect_defects_endpoint(request):
     """
-    Принимает картинку, использует реальную модель для детекции и возвращает результат
+    Принимает картинку и ставит задачу детекции; результат забирают по task_id
     """
     try:
         # Получаем картинку из запроса
@@ -25,153 +154,112 @@ def detect_defects_endpoint(request):
             )
         
         image_file = request.FILES['image']
+        error_response = _check_upload(image_file)
+        if error_response is not None:
+            return error_response
+        
+        # Кодируем в JPEG один раз: эти же байты уходят и в ответ, и в модель
+        jpg, (width, height) = _prepare_jpeg(image_file.read())
+        image_id = _store_image(jpg)
+        
+        task = run_detection.delay(image_id, width, height)
         
-        # Открываем и ресайзим картинку до 512x512
-        image = Image.open(image_file)
-        image = image.convert('RGB')
-        resized_image = image.resize((512, 512), Image.LANCZOS)
-        
-        # Конвертируем в base64 для отправки обратно
-        buffer = io.BytesIO()
-        resized_image.save(buffer, format='JPEG', quality=95)
-        image_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        # Сохраняем во временный файл для передачи в модель
-        tmpdir = tempfile.mkdtemp()
-        try:
-            temp_image_path = Path(tmpdir) / "temp_image.jpg"
-            resized_image.save(temp_image_path, format='JPEG', quality=95)
-            
-            # Используем реальную модель для детекции
-            gemini_result = detect_defects([str(temp_image_path)], model="gemini-2.5-pro")
-            
-            # Конвертируем результат в наш формат
-            detection_data = convert_gemini_to_our_format(gemini_result)
-            
-        except Exception as e:
+        return Response({
+            'success': True,
+            'task_id': task.id,
+            'status_url': reverse('detection_status', args=[task.id]),
+            'image_url': _image_url(image_id),
+            'image_size': {'width': width, 'height': height}
+        }, status=status.HTTP_202_ACCEPTED)
+        
+    except Exception as e:
+        return _error_response(e, 'image')
+
+
+@api_view(['POST'])
+def detect_defects_batch_endpoint(request):
+    """
+    Принимает несколько картинок (поле images) и ставит одну задачу детекции на всех
+    """
+    try:
+        image_files = request.FILES.getlist('images')
+        if not image_files:
             return Response(
-                {'error': f'Detection model error: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'No images provided'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(image_files) > _MAX_BATCH_IMAGES:
+            return Response(
+                {'error': f'Too many images: at most {_MAX_BATCH_IMAGES} per request'}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
-        finally:
-            # Очищаем временные файлы
-            shutil.rmtree(tmpdir, ignore_errors=True)
+        
+        for image_file in image_files:
+            error_response = _check_upload(image_file)
+            if error_response is not None:
+                return error_response
+        
+        prepared = [_prepare_jpeg(image_file.read()) for image_file in image_files]
+        image_ids = [_store_image(jpg) for jpg, _ in prepared]
+        sizes = [size for _, size in prepared]
+        
+        task = run_batch_detection.delay(image_ids, sizes)
+        
+        # Порядок results совпадает с порядком в ответе задачи
+        results = []
+        for image_file, image_id, (width, height) in zip(image_files, image_ids, sizes):
+            results.append({
+                'name': image_file.name,
+                'image_url': _image_url(image_id),
+                'image_size': {'width': width, 'height': height}
+            })
         
         return Response({
             'success': True,
-            'image_base64': f'data:image/jpeg;base64,{image_base64}',
-            'detections': detection_data,
-            'image_size': {'width': 512, 'height': 512}
-        })
+            'task_id': task.id,
+            'status_url': reverse('detection_status', args=[task.id]),
+            'results': results
+        }, status=status.HTTP_202_ACCEPTED)
         
     except Exception as e:
-        return Response(
-            {'error': f'Error processing image: {str(e)}'}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return _error_response(e, 'images')
 
 
-def convert_gemini_to_our_format(gemini_result):
-    """Конвертируем результат Gemini в формат нашего фронтенда"""
-    
-    # Маппинг категорий damage
-    damage_categories = {
-        0: {'id': 0, 'name': 'Hairline', 'type': 'crack'},
-        1: {'id': 1, 'name': 'Fine', 'type': 'crack'},
-        2: {'id': 2, 'name': 'Aesthetic (>1 <5mm)', 'type': 'crack'},
-        3: {'id': 3, 'name': 'Serviceability (>5 <15mm)', 'type': 'crack'},
-        4: {'id': 4, 'name': 'Serviceability (>15 <25mm)', 'type': 'crack'},
-        5: {'id': 5, 'name': 'Stability (>25mm)', 'type': 'crack'},
-    }
-    
-    # Маппинг типов moisture
-    moisture_categories = {
-        'RD': {'id': 'RD', 'name': 'Rising Damp', 'type': 'moisture'},
-        'PD': {'id': 'PD', 'name': 'Penetrating Damp', 'type': 'moisture'},
-        'C': {'id': 'C', 'name': 'Condensation', 'type': 'moisture'},
-    }
+@api_view(['GET'])
+def get_detection_status(request, task_id):
+    """Статус задачи детекции: PENDING/STARTED/RETRY, SUCCESS с результатом или FAILURE"""
+    result = AsyncResult(str(task_id))
     
-    detections = []
-    detection_id = 1
+    if result.successful():
+        return Response({'success': True, 'status': result.status, **result.result})
     
-    # Обрабатываем damage (трещины)
-    for damage in gemini_result.damage:
-        # Конвертируем bbox из формата [y_min, x_min, y_max, x_max] (0-1000) в наш формат
-        y_min, x_min, y_max, x_max = damage.bbox
-        
-        # Переводим из координат 0-1000 в координаты 0-512
-        x1 = int(x_min * 512 / 1000)
-        y1 = int(y_min * 512 / 1000)
-        x2 = int(x_max * 512 / 1000)
-        y2 = int(y_max * 512 / 1000)
-        
-        # Убеждаемся что координаты в пределах изображения
-        x1 = max(0, min(x1, 512))
-        y1 = max(0, min(y1, 512))
-        x2 = max(0, min(x2, 512))
-        y2 = max(0, min(y2, 512))
-        
-        category = damage_categories.get(damage.category, damage_categories[1])
-        
-        detection = {
-            'id': detection_id,
-            'type': 'crack',
-            'category': category,
-            'bbox': {
-                'x1': x1,
-                'y1': y1,
-                'x2': x2,
-                'y2': y2
-            },
-            'confidence': 0.95  # Фиксированный confidence для Gemini
-        }
-        
-        detections.append(detection)
-        detection_id += 1
+    if result.failed():
+        return Response(
+            {'status': result.status, 'error': f'Detection model error: {str(result.result)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
     
-    # Обрабатываем moisture (влагу)
-    for moisture in gemini_result.moisture:
-        # Конвертируем bbox
-        y_min, x_min, y_max, x_max = moisture.bbox
-        
-        x1 = int(x_min * 512 / 1000)
-        y1 = int(y_min * 512 / 1000)
-        x2 = int(x_max * 512 / 1000)
-        y2 = int(y_max * 512 / 1000)
-        
-        x1 = max(0, min(x1, 512))
-        y1 = max(0, min(y1, 512))
-        x2 = max(0, min(x2, 512))
-        y2 = max(0, min(y2, 512))
-        
-        category = moisture_categories.get(moisture.moisture_type, moisture_categories['C'])
-        
-        detection = {
-            'id': detection_id,
-            'type': 'moisture',
-            'category': category,
-            'bbox': {
-                'x1': x1,
-                'y1': y1,
-                'x2': x2,
-                'y2': y2
-            },
-            'confidence': 0.95
-        }
-        
-        detections.append(detection)
-        detection_id += 1
+    return Response({'status': result.status})
+
+
+@api_view(['GET'])
+def get_detection_image(request, image_id):
+    """Отдаёт обработанную картинку (JPEG) по id из ответа детекции"""
+    jpg = cache.get(IMAGE_CACHE_KEY.format(image_id))
+    if jpg is None:
+        return Response(
+            {'error': 'Image not found or expired'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
     
-    return detections
+    response = HttpResponse(jpg, content_type='image/jpeg')
+    response['Cache-Control'] = f'private, max-age={settings.DETECTION_TTL}'
+    return response
 
 
 @api_view(['GET'])
 def get_demo_images(request):
     """Возвращает список демо-изображений из staticfiles/demo"""
-    from django.conf import settings
-    import os
-    
-    demo_images = []
     demo_path = os.path.join(settings.STATIC_ROOT, 'demo')
     
     # Проверяем существует ли папка
@@ -181,33 +269,16 @@ def get_demo_images(request):
             'error': 'Demo folder not found. Run collectstatic first.'
         })
     
-    # Поддерживаемые форматы
-    supported_formats = ['.jpg', '.jpeg', '.png', '.webp']
-    
     try:
-        # Читаем все файлы из папки demo
-        for filename in os.listdir(demo_path):
-            if any(filename.lower().endswith(ext) for ext in supported_formats):
-                file_path = os.path.join(demo_path, filename)
-                
-                # Открываем и конвертируем в base64
-                with open(file_path, 'rb') as img_file:
-                    image = Image.open(img_file)
-                    image = image.convert('RGB')
-                    
-                    # Конвертируем в base64
-                    buffer = io.BytesIO()
-                    image.save(buffer, format='JPEG', quality=95)
-                    image_base64 = base64.b64encode(buffer.getvalue()).decode()
-                    
-                    # Добавляем в список
-                    demo_images.append({
-                        'name': os.path.splitext(filename)[0],  # Имя без расширения
-                        'image_base64': f'data:image/jpeg;base64,{image_base64}'
-                    })
+        files = demo_images.list_demo_files(demo_path)
+        
+        # Готовый манифест отдаём файлом, без кодирования картинок
+        manifest_path = os.path.join(demo_path, demo_images.DEMO_MANIFEST)
+        if demo_images.manifest_is_fresh(manifest_path, files):
+            return FileResponse(open(manifest_path, 'rb'), content_type='application/json')
         
         return Response({
-            'demo_images': demo_images
+            'demo_images': demo_images.get_demo_images(demo_path, files)
         })
         
     except Exception as e: